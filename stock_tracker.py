@@ -1,11 +1,20 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import yfinance as yf
-import requests
-from datetime import date, timedelta, datetime, time as dt_time
-import schedule
-import threading
+import requests_cache
+import asyncio
+import aiohttp
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from datetime import date, timedelta, datetime
+from apscheduler.schedulers.background import BackgroundScheduler
 import time
+import json
+from pathlib import Path
+from io import StringIO
 import pytz
 import os
 from dotenv import load_dotenv
@@ -15,59 +24,183 @@ load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
+# ------------------- Shared HTTP session -------------------
+# One pooled session so repeated Wikipedia calls reuse their TCP/TLS connections;
+# responses are also kept in a local SQLite cache for an hour to survive restarts.
+# st.cache_resource shares it (and its warm pool) across every rerun and session.
+@st.cache_resource
+def get_session():
+    session = requests_cache.CachedSession(".cache/http_cache", expire_after=3600)
+    session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=32,
+                                          max_retries=Retry(total=3, backoff_factor=0.5,
+                                                            status_forcelist=[429, 500, 502, 503, 504])))
+    return session
+
+# (connect, read) timeout so a stalled Wikipedia response can't hang the page
+HTTP_TIMEOUT = (3, 10)
+
 # ------------------- Telegram function -------------------
-def send_telegram_message(message):
+async def send_telegram_async(session, message):
     url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
     payload = {"chat_id": TELEGRAM_CHAT_ID, "text": message}
     try:
-        requests.post(url, data=payload)
+        async with session.post(url, data=payload, timeout=aiohttp.ClientTimeout(total=5)):
+            pass
     except Exception as e:
         st.write(f"⚠️ Telegram send failed: {e}")
 
+async def send_telegram_messages(messages):
+    # Fire all alerts concurrently instead of one blocking POST after another
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(send_telegram_async(session, m) for m in messages))
+
 # ------------------- Utility -------------------
 def fetch_html(url):
     headers = {"User-Agent": "Mozilla/5.0"}
-    response = requests.get(url, headers=headers)
+    response = get_session().get(url, headers=headers, timeout=HTTP_TIMEOUT)
     response.raise_for_status()
     return response.text
 
+# Ticker lists change monthly at most, so keep them on disk for a day to skip
+# the Wikipedia fetch and HTML parse on cold starts
+CACHE_DIR = Path(".cache")
+TICKER_LIST_TTL = 24 * 60 * 60
+
+def load_cached_list(name):
+    path = CACHE_DIR / f"{name}.json"
+    if path.exists() and time.time() - path.stat().st_mtime < TICKER_LIST_TTL:
+        return json.loads(path.read_text())
+    return None
+
+def save_cached_list(name, items):
+    CACHE_DIR.mkdir(exist_ok=True)
+    (CACHE_DIR / f"{name}.json").write_text(json.dumps(items))
+
+PRICE_TTL = 60 * 60
+# Tickers missing from a download (often symbols Yahoo no longer lists) are retried this often
+MISSING_RETRY_TTL = 5 * 60
+
+class EmptyDownload(Exception):
+    # Raised instead of returning so st.cache_data never memoizes a download that got nothing
+    pass
+
+def download_close_prices(tickers, start, end):
+    data = yf.download(tickers, start=start, end=end, group_by="ticker",
+                       threads=True, progress=False, auto_adjust=True)
+    if data.empty:
+        return pd.DataFrame()
+    return data.xs("Close", level=1, axis=1).dropna(axis=1, how="all")
+
+@st.cache_data(ttl=PRICE_TTL)
+def fetch_close_prices(tickers, start, end):
+    # One batched download for all tickers, memoized across reruns with the same window.
+    # yfinance rejects caching sessions (requests_cache), so the cache lives here instead.
+    # A partial frame is cached too; session_close_prices re-requests just the missing tickers.
+    fetched_at = time.time()
+    close = download_close_prices(tickers, start, end)
+    if close.empty:
+        raise EmptyDownload()
+    return fetched_at, close
+
+@st.cache_data(ttl=MISSING_RETRY_TTL)
+def fetch_missing_close_prices(tickers, start, end):
+    # Cached even when still empty, so a dead symbol costs one small request every few minutes
+    return download_close_prices(tickers, start, end)
+
+def session_close_prices(slot, tickers, start, end):
+    # st.cache_data unpickles a fresh copy on every call; keep the current window's frame in
+    # session_state (one entry per slot) so reruns that leave the window unchanged reuse the
+    # same object. The age is taken from the download itself, so PRICE_TTL bounds both layers.
+    key = (tuple(tickers), start, end)
+    now = time.time()
+    if (st.session_state.get(f"{slot}_params") != key
+            or now - st.session_state[f"{slot}_fetched_at"] > PRICE_TTL):
+        try:
+            fetched_at, close = fetch_close_prices(tickers, start, end)
+        except EmptyDownload:
+            # Nothing came back, so keep nothing and let the next rerun retry the download
+            for name in ("params", "fetched_at", "close", "retried_at"):
+                st.session_state.pop(f"{slot}_{name}", None)
+            return pd.DataFrame()
+        st.session_state[f"{slot}_params"] = key
+        st.session_state[f"{slot}_fetched_at"] = fetched_at
+        st.session_state[f"{slot}_close"] = close
+        st.session_state[f"{slot}_retried_at"] = 0.0
+
+    close = st.session_state[f"{slot}_close"]
+    missing = [t for t in tickers if t not in close.columns]
+    if missing and now - st.session_state[f"{slot}_retried_at"] > MISSING_RETRY_TTL:
+        extra = fetch_missing_close_prices(missing, start, end)
+        if not extra.empty:
+            close = pd.concat([close, extra], axis=1)
+            st.session_state[f"{slot}_close"] = close
+        st.session_state[f"{slot}_retried_at"] = now
+    return close
+
+def fetch_history(ticker, start, end):
+    # Runs in a worker thread, so errors are handed back for the script thread to report
+    try:
+        return ticker, yf.Ticker(ticker).history(start=start, end=end), None
+    except Exception as e:
+        return ticker, None, e
+
+def compute_pct_change(close):
+    # close: wide frame (dates x tickers); take each column's first and last valid price
+    prices = close.to_numpy(dtype=np.float64)
+    valid = np.isfinite(prices)
+    cols = np.arange(prices.shape[1])
+    first = valid.argmax(axis=0)
+    last = prices.shape[0] - 1 - valid[::-1].argmax(axis=0)
+    start_prices = prices[first, cols]
+    end_prices = prices[last, cols]
+    pct_change = (end_prices / start_prices - 1.0) * 100.0
+    return pd.DataFrame({"Ticker": close.columns, "Start Price": start_prices,
+                         "End Price": end_prices, "% Change": pct_change})
+
 # ------------------- Top 50 Stocks -------------------
 @st.cache_data
 def get_us_top50():
+    cached = load_cached_list("us_top50")
+    if cached is not None:
+        return cached
     url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
     html = fetch_html(url)
-    tables = pd.read_html(html)
-    return tables[0]["Symbol"].tolist()[:50]
+    tables = pd.read_html(StringIO(html), match="Symbol", attrs={"id": "constituents"},
+                          flavor="lxml", keep_default_na=False)
+    tickers = tables[0]["Symbol"].tolist()[:50]
+    save_cached_list("us_top50", tickers)
+    return tickers
 
 @st.cache_data
 def get_india_top50():
+    cached = load_cached_list("india_top50")
+    if cached is not None:
+        return cached
     url = "https://en.wikipedia.org/wiki/NIFTY_50"
     html = fetch_html(url)
-    tables = pd.read_html(html)
-    table = None
-    for t in tables:
-        if any(col in t.columns for col in ["Symbol", "Company Name", "Ticker"]):
-            table = t
-            break
+    try:
+        tables = pd.read_html(StringIO(html), match="Symbol|Ticker|Company Name",
+                              flavor="lxml", keep_default_na=False)
+    except ValueError:
+        tables = []
+    # match= keeps any table that mentions the text anywhere, so pick the one with a ticker column
+    ticker_cols = ["Symbol", "Ticker", "Company Name"]
+    table = next((t for t in tables if any(c in t.columns for c in ticker_cols)), None)
     if table is None:
         st.error("⚠️ Could not find NIFTY 50 table on Wikipedia.")
         return []
-    col_name = None
-    for c in ["Symbol", "Ticker", "Company Name"]:
-        if c in table.columns:
-            col_name = c
-            break
-    if col_name is None:
-        st.error("⚠️ No usable ticker column found in NIFTY 50 table.")
-        return []
-    return table[col_name].astype(str).apply(lambda x: x + ".NS").tolist()[:50]
+    col_name = next(c for c in ticker_cols if c in table.columns)
+    tickers = (table[col_name].astype(str) + ".NS").tolist()[:50]
+    save_cached_list("india_top50", tickers)
+    return tickers
 
 # ------------------- Full Ticker Universe for Autosuggest -------------------
 @st.cache_data
 def get_all_tickers():
     # US: S&P500 full list
     url_us = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
-    us_table = pd.read_html(fetch_html(url_us))[0]
+    us_table = pd.read_html(StringIO(fetch_html(url_us)), match="Symbol", attrs={"id": "constituents"},
+                            flavor="lxml", keep_default_na=False)[0]
     us_tickers = us_table["Symbol"].tolist()
     # India: NSE listed stocks CSV
     try:
@@ -94,24 +227,32 @@ gain_threshold = st.slider("Gain Alert Threshold (%)", 0.0, 10.0, 5.0, step=0.5)
 tickers = get_us_top50() if exchange == "US" else get_india_top50()
 end_date_plus = end_date + timedelta(days=1)
 
+last_week_start = date.today() - timedelta(days=7)
+last_week_end = date.today() + timedelta(days=1)
+
+# If the selected range reaches last week, one download spans both and each view slices its
+# own rows; otherwise the ranges are disjoint and merging would fetch the whole gap between them
+prices_full = None
+prices_weekly = None
+if tickers:
+    if end_date >= last_week_start:
+        prices_full = session_close_prices("prices_full", tickers, min(start_date, last_week_start),
+                                           max(end_date_plus, last_week_end))
+        prices_weekly = prices_full
+    else:
+        prices_full = session_close_prices("prices_full", tickers, start_date, end_date_plus)
+        prices_weekly = session_close_prices("prices_weekly", tickers, last_week_start, last_week_end)
+
 # ------------------- Top 50 Stock Data -------------------
 st.subheader(f"Top 50 Stocks - {exchange}")
-results = []
-for ticker in tickers:
-    try:
-        stock = yf.Ticker(ticker)
-        data = stock.history(start=start_date, end=end_date_plus)
-        if not data.empty:
-            start_price = data["Close"].iloc[0]
-            end_price = data["Close"].iloc[-1]
-            pct_change = ((end_price - start_price) / start_price) * 100
-            results.append([ticker, start_price, end_price, pct_change])
-    except:
-        continue
+results = None
+if prices_full is not None and not prices_full.empty:
+    close = prices_full.loc[str(start_date):str(end_date)].dropna(axis=1, how="all")
+    if not close.empty:
+        results = compute_pct_change(close)
 
-if results:
-    df = pd.DataFrame(results, columns=["Ticker", "Start Price", "End Price", "% Change"])
-    df = df.sort_values("% Change", ascending=False).reset_index(drop=True)
+if results is not None:
+    df = results.sort_values("% Change", ascending=False).reset_index(drop=True)
     st.dataframe(df)
     overall_pct = df["% Change"].mean()
     st.metric("📊 Overall Portfolio % Change (Top 50)", f"{overall_pct:.2f}%")
@@ -124,25 +265,16 @@ with st.expander("Set Weekly Thresholds"):
     drop_weekly_threshold = st.slider("Weekly Drop Threshold (%)", -10.0, 0.0, -2.0, step=0.5)
     gain_weekly_threshold = st.slider("Weekly Gain Threshold (%)", 0.0, 10.0, 1.0, step=0.5)
 
-last_week_start = date.today() - timedelta(days=7)
-last_week_end = date.today() + timedelta(days=1)
-
-drop_gain_results = []
-for ticker in tickers:
-    try:
-        stock = yf.Ticker(ticker)
-        data = stock.history(start=last_week_start, end=last_week_end)
-        if not data.empty:
-            start_price = data["Close"].iloc[0]
-            end_price = data["Close"].iloc[-1]
-            pct_change = ((end_price - start_price) / start_price) * 100
-            if pct_change <= drop_weekly_threshold or pct_change >= gain_weekly_threshold:
-                drop_gain_results.append([ticker, start_price, end_price, pct_change])
-    except:
-        continue
+drop_gain_df = None
+if prices_weekly is not None and not prices_weekly.empty:
+    close = prices_weekly.loc[str(last_week_start):].dropna(axis=1, how="all")
+    if not close.empty:
+        weekly_df = compute_pct_change(close)
+        pct = weekly_df["% Change"]
+        keep = (pct <= drop_weekly_threshold) | (pct >= gain_weekly_threshold)
+        drop_gain_df = weekly_df[keep].sort_values("% Change", ascending=False).reset_index(drop=True)
 
-if drop_gain_results:
-    drop_gain_df = pd.DataFrame(drop_gain_results, columns=["Ticker", "Start Price", "End Price", "% Change"])
+if drop_gain_df is not None and not drop_gain_df.empty:
     st.dataframe(drop_gain_df)
 else:
     st.info("No stocks matched the weekly drop/gain criteria.")
@@ -160,22 +292,29 @@ custom_end_date = st.date_input("Custom End Date", date.today(), key="custom_end
 custom_end_plus = custom_end_date + timedelta(days=1)
 
 if custom_tickers_selected:
-    custom_results = []
-    for ticker in custom_tickers_selected:
-        try:
-            stock = yf.Ticker(ticker)
-            data = stock.history(start=custom_start_date, end=custom_end_plus)
-            if not data.empty:
-                start_price = data["Close"].iloc[0]
-                end_price = data["Close"].iloc[-1]
-                pct_change = ((end_price - start_price) / start_price) * 100
-                custom_results.append([ticker, start_price, end_price, pct_change])
-        except Exception as e:
-            st.write(f"⚠️ Skipping {ticker}: {e}")
-            continue
-
-    if custom_results:
-        custom_df = pd.DataFrame(custom_results, columns=["Ticker", "Start Price", "End Price", "% Change"])
+    fetch = partial(fetch_history, start=custom_start_date, end=custom_end_plus)
+    with ThreadPoolExecutor(max_workers=min(20, len(custom_tickers_selected))) as executor:
+        fetched = list(executor.map(fetch, custom_tickers_selected))
+
+    # Typed arrays sized for every ticker, filled by index; k counts successful fetches
+    n = len(fetched)
+    syms = np.empty(n, dtype=object)
+    start_prices = np.empty(n, dtype=np.float64)
+    end_prices = np.empty(n, dtype=np.float64)
+    k = 0
+    for ticker, data, error in fetched:
+        if error is not None:
+            st.write(f"⚠️ Skipping {ticker}: {error}")
+        elif not data.empty:
+            syms[k] = ticker
+            start_prices[k] = data["Close"].iloc[0]
+            end_prices[k] = data["Close"].iloc[-1]
+            k += 1
+
+    if k:
+        pct_change = (end_prices[:k] / start_prices[:k] - 1.0) * 100.0
+        custom_df = pd.DataFrame({"Ticker": syms[:k], "Start Price": start_prices[:k],
+                                  "End Price": end_prices[:k], "% Change": pct_change})
         custom_df = custom_df.sort_values("% Change", ascending=False).reset_index(drop=True)
         st.dataframe(custom_df)
         overall_pct_custom = custom_df["% Change"].mean()
@@ -184,42 +323,49 @@ if custom_tickers_selected:
         st.info("No data available for the selected tickers.")
 
 # ------------------- Background Scheduler for Indian Stocks -------------------
-def check_indian_stocks(drop_threshold, gain_threshold):
-    ist = pytz.timezone("Asia/Kolkata")
-    now = datetime.now(ist)
-    if now.weekday() >= 5:  # skip weekends
+IST = pytz.timezone("Asia/Kolkata")
+
+async def check_indian_stocks(tickers_list, drop_threshold, gain_threshold):
+    today = datetime.now(IST).date()
+    try:
+        data = await asyncio.to_thread(yf.download, tickers_list, start=today, end=today + timedelta(days=1),
+                                       group_by="ticker", threads=True, progress=False, auto_adjust=True)
+    except Exception:
         return
-    market_open = dt_time(9, 30)
-    market_close = dt_time(15, 30)
-    if not (market_open <= now.time() <= market_close):
+    if data.empty:
         return
+    # The window holds a single daily bar per ticker, so a first-vs-last close is always 0%;
+    # measure today's move from the bar's open to its latest close instead
+    today_bar = pd.DataFrame([data.xs("Open", level=1, axis=1).iloc[-1],
+                              data.xs("Close", level=1, axis=1).iloc[-1]]).dropna(axis=1, how="any")
+    if today_bar.empty:
+        return
+    changes = compute_pct_change(today_bar)
+    alerts = []
+    for ticker, start_price, end_price, pct_change in changes.itertuples(index=False):
+        if pct_change <= drop_threshold:
+            alerts.append(f"🔻 Alert: {ticker} fell {pct_change:.2f}% today ({start_price:.2f} → {end_price:.2f})")
+        elif pct_change >= gain_threshold:
+            alerts.append(f"🔺 Alert: {ticker} rose {pct_change:.2f}% today ({start_price:.2f} → {end_price:.2f})")
+    if alerts:
+        await send_telegram_messages(alerts)
 
-    tickers_list = get_india_top50()
-    for ticker in tickers_list:
-        try:
-            stock = yf.Ticker(ticker)
-            today = now.date()
-            data = stock.history(start=today, end=today + timedelta(days=1))
-            if not data.empty:
-                start_price = data["Close"].iloc[0]
-                end_price = data["Close"].iloc[-1]
-                pct_change = ((end_price - start_price) / start_price) * 100
-                if pct_change <= drop_threshold:
-                    message = f"🔻 Alert: {ticker} fell {pct_change:.2f}% today ({start_price:.2f} → {end_price:.2f})"
-                    send_telegram_message(message)
-                elif pct_change >= gain_threshold:
-                    message = f"🔺 Alert: {ticker} rose {pct_change:.2f}% today ({start_price:.2f} → {end_price:.2f})"
-                    send_telegram_message(message)
-        except:
-            continue
-
-def run_indian_scheduler():
-    # Run every 1 hour during market hours
-    schedule.every(1).hours.do(check_indian_stocks, drop_threshold=drop_threshold, gain_threshold=gain_threshold)
-    while True:
-        schedule.run_pending()
-        time.sleep(60)
-
-# Run scheduler only if India selected
-if exchange == "India":
-    threading.Thread(target=run_indian_scheduler, daemon=True).start()
+def run_indian_check(tickers_list, drop_threshold, gain_threshold):
+    asyncio.run(check_indian_stocks(tickers_list, drop_threshold, gain_threshold))
+
+def run_indian_scheduler(tickers_list, drop_threshold, gain_threshold):
+    # Fire hourly at 09:30-15:30 IST on weekdays only, so nothing wakes up while the market is closed
+    scheduler = BackgroundScheduler(daemon=True, timezone=IST)
+    scheduler.add_job(run_indian_check, "cron", day_of_week="mon-fri", hour="9-15", minute=30,
+                      args=[tickers_list, drop_threshold, gain_threshold], id="india_alerts")
+    scheduler.start()
+    return scheduler
+
+# Run scheduler only if India selected. Streamlit reruns the script on every widget change,
+# so start it once per session and only refresh the job's thresholds afterwards
+if exchange == "India" and tickers:
+    if "india_scheduler" not in st.session_state:
+        st.session_state["india_scheduler"] = run_indian_scheduler(tickers, drop_threshold, gain_threshold)
+    else:
+        st.session_state["india_scheduler"].modify_job(
+            "india_alerts", args=[tickers, drop_threshold, gain_threshold])